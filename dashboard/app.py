@@ -1,14 +1,262 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
-import altair as alt
 
 
 @st.cache_data
 def load_data() -> pd.DataFrame:
-    df = pd.read_csv("data/processed/rfm_segments.csv")
+    df = pd.read_parquet("data/processed/rfm_segments.parquet", dtype_backend="pyarrow")
     return df
 
 
+def _integer_bin_edges(values: pd.Series, bins: int, log: bool = False) -> np.ndarray:
+    """
+    Integer bin edges for an integer-valued column: bin i holds the values
+    edges[i] .. edges[i + 1] - 1. One bin per value when the range fits in
+    `bins`, otherwise equal-width (or, with log=True, log-spaced) integer steps.
+    """
+    lo, hi = int(values.min()), int(values.max())
+    if hi - lo + 1 <= bins:
+        return np.arange(lo, hi + 2)
+    if log:
+        edges = np.round(np.geomspace(max(lo, 1), hi + 1, bins + 1)).astype(int)
+        edges[0] = lo
+        return np.unique(edges)
+    step = -(-(hi - lo + 1) // bins)
+    return np.arange(lo, hi + step + 1, step)
+
+
+def _bin_labels(edges: np.ndarray) -> np.ndarray:
+    """"lo" for single-value bins, "lo-hi" (inclusive) otherwise."""
+    return np.array(
+        [str(a) if b - a == 1 else f"{a}-{b - 1}" for a, b in zip(edges[:-1], edges[1:])]
+    )
+
+
+def recency_frequency_grid(df: pd.DataFrame, cluster_col: str, bins: int = 50) -> pd.DataFrame:
+    """
+    Bin Recency x Frequency into a (at most) bins x bins grid per segment, so
+    the chart gets one row per occupied cell instead of one row per customer.
+
+    Both columns are whole numbers, so the bins are integer-aligned; Frequency
+    is heavily skewed towards 1-5 orders and gets log-spaced bins. Each cell
+    is reported at its lower bound, with its value range for the tooltip.
+    """
+    columns = [cluster_col, "Recency", "Frequency", "Recency range", "Frequency range", "Customers"]
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    x_edges = _integer_bin_edges(df["Recency"], bins)
+    y_edges = _integer_bin_edges(df["Frequency"], bins, log=True)
+    x_labels = _bin_labels(x_edges)
+    y_labels = _bin_labels(y_edges)
+
+    parts = []
+    for segment, seg_df in df.groupby(cluster_col, sort=False):
+        hist, _, _ = np.histogram2d(
+            seg_df["Recency"], seg_df["Frequency"], bins=[x_edges, y_edges]
+        )
+        xi, yi = np.nonzero(hist)
+        parts.append(
+            pd.DataFrame(
+                {
+                    cluster_col: segment,
+                    "Recency": x_edges[xi],
+                    "Frequency": y_edges[yi],
+                    "Recency range": x_labels[xi],
+                    "Frequency range": y_labels[yi],
+                    "Customers": hist[xi, yi].astype(int),
+                }
+            )
+        )
+
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)
+
+
+def clv_box_stats(df: pd.DataFrame, cluster_col: str) -> pd.DataFrame:
+    """Per-segment min / quartiles / max of CLV_6m for a precomputed boxplot."""
+    if df.empty:
+        return pd.DataFrame(columns=[cluster_col, "Min", "Q1", "Median", "Q3", "Max"])
+
+    stats = (
+        df.groupby(cluster_col, sort=False)["CLV_6m"]
+        .quantile([0.0, 0.25, 0.5, 0.75, 1.0])
+        .unstack()
+        .dropna()
+    )
+    stats = stats.rename(
+        columns={0.0: "Min", 0.25: "Q1", 0.5: "Median", 0.75: "Q3", 1.0: "Max"}
+    )
+    return stats.reset_index()
+
+
+@st.cache_data(max_entries=64)
+def filter_and_summarize(
+    _df: pd.DataFrame,
+    selected_countries: tuple[str, ...],
+    clv_filter: float | None,
+    freq_filter: int,
+    cluster_col: str,
+):
+    """
+    Apply the sidebar filters and build the segment summary and top-15
+    country revenue table. Cached on the (hashable) filter values; _df is
+    the load_data() result, which is itself cached, so it is not hashed.
+    """
+    filtered = _df
+    if selected_countries:
+        filtered = filtered[filtered["PrimaryCountry"].isin(selected_countries)]
+    if clv_filter is not None:
+        filtered = filtered[filtered["CLV_6m"] >= clv_filter]
+    filtered = filtered[filtered["Frequency"] >= freq_filter]
+
+    # one scan keyed by (segment, country); the segment summary and the
+    # country revenue table are both marginals of these cells. Means are
+    # carried as sum + count so they stay exact after re-aggregation.
+    # The processed table has one row per CustomerID, so a plain count
+    # equals the distinct count without nunique's per-group hashing.
+    has_clv = "CLV_6m" in filtered.columns
+    agg_spec = {
+        "Customers": ("CustomerID", "count"),
+        "TotalRevenue": ("Monetary", "sum"),
+        "RecencySum": ("Recency", "sum"),
+        "FrequencySum": ("Frequency", "sum"),
+    }
+    if has_clv:
+        agg_spec["CLVSum"] = ("CLV_6m", "sum")
+        agg_spec["CLVCount"] = ("CLV_6m", "count")
+
+    cells = filtered.groupby(
+        [cluster_col, "PrimaryCountry"], sort=False, observed=True, dropna=False
+    ).agg(**agg_spec)
+
+    seg = cells.groupby(level=cluster_col).sum()
+    summary = pd.DataFrame(
+        {
+            "Customers": seg["Customers"],
+            "TotalRevenue": seg["TotalRevenue"],
+            "AvgRecency": seg["RecencySum"] / seg["Customers"],
+            "AvgFrequency": seg["FrequencySum"] / seg["Customers"],
+        }
+    )
+    if has_clv:
+        summary["AvgCLV"] = seg["CLVSum"] / seg["CLVCount"]
+    summary = summary.reset_index()
+
+    country_rev = (
+        cells.groupby(level="PrimaryCountry")["TotalRevenue"]
+        .sum()
+        .reset_index()
+        .rename(columns={"TotalRevenue": "Revenue"})
+        .sort_values("Revenue", ascending=False)
+        .head(15)
+    )
+
+    return filtered, summary, country_rev
+
+
+# ---------------- Chart specs ----------------
+# Plain Vega-Lite dicts, built once per cluster column and reused across
+# reruns; st.vega_lite_chart takes them as-is, skipping Altair's per-rerun
+# chart construction and schema validation in to_dict().
+
+PAN_ZOOM = [{"name": "grid", "select": "interval", "bind": "scales"}]
+
+
+@st.cache_resource
+def recency_frequency_spec(cluster_col: str) -> dict:
+    return {
+        "mark": {"type": "circle", "opacity": 0.6},
+        "encoding": {
+            "x": {"field": "Recency", "type": "quantitative",
+                  "title": "Recency (days since last purchase)"},
+            "y": {"field": "Frequency", "type": "quantitative",
+                  "title": "Frequency (number of orders)"},
+            "size": {"field": "Customers", "type": "quantitative", "title": "Customers"},
+            "color": {"field": cluster_col, "type": "nominal"},
+            "tooltip": [
+                {"field": cluster_col, "type": "nominal"},
+                {"field": "Recency range", "type": "nominal", "title": "Recency (days)"},
+                {"field": "Frequency range", "type": "nominal", "title": "Frequency (orders)"},
+                {"field": "Customers", "type": "quantitative"},
+            ],
+        },
+        "params": PAN_ZOOM,
+    }
+
+
+@st.cache_resource
+def monetary_clv_spec(cluster_col: str) -> dict:
+    return {
+        "mark": {"type": "circle", "opacity": 0.6},
+        "encoding": {
+            "x": {"field": "Monetary", "type": "quantitative",
+                  "title": "Historical Monetary value"},
+            "y": {"field": "CLV_6m", "type": "quantitative",
+                  "title": "Predicted CLV (6 months)"},
+            "color": {"field": cluster_col, "type": "nominal"},
+            "tooltip": [
+                {"field": "CustomerID", "type": "nominal"},
+                {"field": "Monetary", "type": "quantitative", "format": ",.2f"},
+                {"field": "CLV_6m", "type": "quantitative", "format": ",.2f"},
+                {"field": "Recency", "type": "quantitative"},
+                {"field": "Frequency", "type": "quantitative"},
+            ],
+        },
+        "params": PAN_ZOOM,
+    }
+
+
+@st.cache_resource
+def clv_box_spec(cluster_col: str) -> dict:
+    x = {"field": cluster_col, "type": "ordinal"}
+    return {
+        "layer": [
+            {
+                "mark": "rule",
+                "encoding": {
+                    "x": x,
+                    "y": {"field": "Min", "type": "quantitative", "title": "CLV (6 months)"},
+                    "y2": {"field": "Max"},
+                },
+            },
+            {
+                "mark": {"type": "bar", "size": 30},
+                "encoding": {
+                    "x": x,
+                    "y": {"field": "Q1", "type": "quantitative"},
+                    "y2": {"field": "Q3"},
+                },
+            },
+            {
+                "mark": {"type": "tick", "color": "white", "size": 30},
+                "encoding": {
+                    "x": x,
+                    "y": {"field": "Median", "type": "quantitative"},
+                },
+            },
+        ],
+    }
+
+
+@st.cache_resource
+def country_revenue_spec() -> dict:
+    return {
+        "mark": "bar",
+        "encoding": {
+            "x": {"field": "Revenue", "type": "quantitative", "title": "Revenue"},
+            "y": {"field": "PrimaryCountry", "type": "nominal", "sort": "-x",
+                  "title": "Country"},
+            "tooltip": [
+                {"field": "PrimaryCountry", "type": "nominal"},
+                {"field": "Revenue", "type": "quantitative"},
+            ],
+        },
+    }
+
+
 def main():
     st.set_page_config(
         page_title="Customer Segmentation using RFM + CLV",
@@ -60,12 +308,13 @@ def main():
     show_raw = st.sidebar.checkbox("Show raw customer table", value=False)
 
     # ---------------- Filtered data ----------------
-    filtered = df.copy()
-    if selected_countries:
-        filtered = filtered[filtered["PrimaryCountry"].isin(selected_countries)]
-    if clv_filter is not None:
-        filtered = filtered[filtered["CLV_6m"] >= clv_filter]
-    filtered = filtered[filtered["Frequency"] >= freq_filter]
+    filtered, summary, country_rev = filter_and_summarize(
+        df,
+        tuple(sorted(selected_countries)),
+        clv_filter,
+        freq_filter,
+        cluster_col,
+    )
 
     # ---------------- Title ----------------
     st.title("Customer Segmentation using RFM + CLV + Clustering")
@@ -78,7 +327,7 @@ def main():
     # ---------------- KPI cards ----------------
     kpi1, kpi2, kpi3 = st.columns(3)
 
-    total_customers = filtered["CustomerID"].nunique()
+    total_customers = len(filtered)  # one row per customer
     total_revenue = filtered["Monetary"].sum()
     avg_clv = filtered["CLV_6m"].mean() if "CLV_6m" in filtered.columns else float("nan")
 
@@ -92,30 +341,6 @@ def main():
     # ---------------- Segment summary ----------------
     st.subheader("Segment summary")
 
-    agg_dict = {
-        "CustomerID": "nunique",
-        "Monetary": "sum",
-        "Recency": "mean",
-        "Frequency": "mean",
-    }
-    if "CLV_6m" in filtered.columns:
-        agg_dict["CLV_6m"] = "mean"
-
-    summary = (
-        filtered.groupby(cluster_col)
-        .agg(agg_dict)
-        .reset_index()
-        .rename(
-            columns={
-                "CustomerID": "Customers",
-                "Monetary": "TotalRevenue",
-                "Recency": "AvgRecency",
-                "Frequency": "AvgFrequency",
-                "CLV_6m": "AvgCLV",
-            }
-        )
-    )
-
     st.dataframe(summary, use_container_width=True)
 
     # ---------------- Auto insights ----------------
@@ -166,87 +391,39 @@ def main():
     # Recency vs Frequency
     with col1:
         st.markdown("**Recency vs Frequency by segment**")
-        chart_rf = (
-            alt.Chart(filtered)
-            .mark_circle(opacity=0.6)
-            .encode(
-                x=alt.X("Recency", title="Recency (days since last purchase)"),
-                y=alt.Y("Frequency", title="Frequency (number of orders)"),
-                color=cluster_col,
-                tooltip=[
-                    "CustomerID",
-                    "Recency",
-                    "Frequency",
-                    "Monetary",
-                    "CLV_6m",
-                    "PrimaryCountry",
-                ],
-            )
-            .interactive()
+        st.vega_lite_chart(
+            recency_frequency_grid(filtered, cluster_col),
+            recency_frequency_spec(cluster_col),
+            use_container_width=True,
         )
-        st.altair_chart(chart_rf, use_container_width=True)
 
     # Monetary vs CLV
     with col2:
         if "CLV_6m" in filtered.columns:
             st.markdown("**Monetary vs CLV (6m) by segment**")
-            chart_mv = (
-                alt.Chart(filtered)
-                .mark_circle(opacity=0.6)
-                .encode(
-                    x=alt.X("Monetary", title="Historical Monetary value"),
-                    y=alt.Y("CLV_6m", title="Predicted CLV (6 months)"),
-                    color=cluster_col,
-                    tooltip=[
-                        "CustomerID",
-                        "Monetary",
-                        "CLV_6m",
-                        "Recency",
-                        "Frequency",
-                    ],
-                )
-                .interactive()
+            # send only the columns the spec encodes
+            scatter_df = filtered[
+                ["CustomerID", "Monetary", "CLV_6m", "Recency", "Frequency", cluster_col]
+            ]
+            st.vega_lite_chart(
+                scatter_df, monetary_clv_spec(cluster_col), use_container_width=True
             )
-            st.altair_chart(chart_mv, use_container_width=True)
         else:
             st.info("CLV_6m not available in data.")
 
     # CLV distribution per segment
     if "CLV_6m" in filtered.columns:
         st.subheader("CLV distribution by segment")
-        chart_clv_box = (
-            alt.Chart(filtered)
-            .mark_boxplot()
-            .encode(
-                x=cluster_col,
-                y=alt.Y("CLV_6m", title="CLV (6 months)"),
-            )
+        st.vega_lite_chart(
+            clv_box_stats(filtered, cluster_col),
+            clv_box_spec(cluster_col),
+            use_container_width=True,
         )
-        st.altair_chart(chart_clv_box, use_container_width=True)
 
     # Revenue by country
     st.subheader("Revenue by country (filtered)")
 
-    country_rev = (
-        filtered.groupby("PrimaryCountry")["Monetary"]
-        .sum()
-        .reset_index()
-        .rename(columns={"Monetary": "Revenue"})
-        .sort_values("Revenue", ascending=False)
-        .head(15)
-    )
-
-    chart_country = (
-        alt.Chart(country_rev)
-        .mark_bar()
-        .encode(
-            x=alt.X("Revenue:Q", title="Revenue"),
-            y=alt.Y("PrimaryCountry:N", sort="-x", title="Country"),
-            tooltip=["PrimaryCountry", "Revenue"],
-        )
-    )
-
-    st.altair_chart(chart_country, use_container_width=True)
+    st.vega_lite_chart(country_rev, country_revenue_spec(), use_container_width=True)
 
     # ---------------- Raw data (optional) ----------------
     if show_raw:
@@ -1,12 +1,25 @@
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import matplotlib
+
+matplotlib.use("Agg")  # file output only; skip interactive backend setup
 import matplotlib.pyplot as plt
+from matplotlib.lines import Line2D
 
 
-DATA_PATH = Path("data/processed/rfm_segments.csv")
+DATA_PATH = Path("data/processed/rfm_segments.parquet")
 FIG_DIR = Path("reports/figures")
 
+# tight_layout() already fits each figure, so skip bbox_inches="tight"
+# (it renders the figure a second time to measure extents); fast PNG zlib level
+SAVEFIG_KWARGS = {"dpi": 150, "pil_kwargs": {"compress_level": 1}}
+
+# above this many customers the scatter is rasterized into a pixel grid
+# instead of drawing one marker per point
+SCATTER_RASTER_THRESHOLD = 50_000
+
 
 def load_data() -> pd.DataFrame:
     if not DATA_PATH.exists():
@@ -14,7 +27,7 @@ def load_data() -> pd.DataFrame:
             f"Processed data not found at {DATA_PATH}. "
             f"Run `python run_pipeline.py` first."
         )
-    df = pd.read_csv(DATA_PATH)
+    df = pd.read_parquet(DATA_PATH, dtype_backend="pyarrow")
     return df
 
 
@@ -54,7 +67,7 @@ def plot_rfm_distributions(df: pd.DataFrame):
 
     plt.tight_layout()
     out_path = FIG_DIR / "rfm_distributions.png"
-    plt.savefig(out_path, dpi=150, bbox_inches="tight")
+    fig.savefig(out_path, **SAVEFIG_KWARGS)
     plt.close(fig)
     print(f"Saved {out_path}")
 
@@ -62,7 +75,7 @@ def plot_rfm_distributions(df: pd.DataFrame):
 def plot_segment_revenue_share(df: pd.DataFrame, cluster_col: str):
     """Revenue share by segment."""
     seg_rev = (
-        df.groupby(cluster_col)["Monetary"]
+        df.groupby(cluster_col, sort=False)["Monetary"]
         .sum()
         .rename("Revenue")
         .reset_index()
@@ -80,7 +93,7 @@ def plot_segment_revenue_share(df: pd.DataFrame, cluster_col: str):
 
     plt.tight_layout()
     out_path = FIG_DIR / "segment_revenue_share.png"
-    plt.savefig(out_path, dpi=150, bbox_inches="tight")
+    fig.savefig(out_path, **SAVEFIG_KWARGS)
     plt.close(fig)
     print(f"Saved {out_path}")
 
@@ -102,32 +115,98 @@ def plot_clv_by_segment_boxplot(df: pd.DataFrame, cluster_col: str):
     ax.grid(True, axis="y", alpha=0.3)
     plt.tight_layout()
     out_path = FIG_DIR / "clv_by_segment_boxplot.png"
-    plt.savefig(out_path, dpi=150, bbox_inches="tight")
+    fig.savefig(out_path, **SAVEFIG_KWARGS)
     plt.close(fig)
     print(f"Saved {out_path}")
 
 
+def _spread(counts: np.ndarray, px: int) -> np.ndarray:
+    """Max-filter each layer over a (2 * px + 1) square (datashader's spread)."""
+    height, width = counts.shape[1:]
+    padded = np.pad(counts, ((0, 0), (px, px), (px, px)))
+    out = np.zeros_like(counts)
+    for dy in range(2 * px + 1):
+        for dx in range(2 * px + 1):
+            np.maximum(out, padded[:, dy:dy + height, dx:dx + width], out=out)
+    return out
+
+
+def rasterize_by_segment(
+    x, y, segments, colors, width: int = 600, height: int = 400,
+    spread: int = 2, min_alpha: float = 0.5,
+):
+    """
+    Bin points into a height x width grid per segment (datashader-style
+    count_cat). Counts are spread over neighbouring pixels so isolated
+    points stay visible; each pixel takes the colour of its most frequent
+    segment, with alpha rising with log point count from min_alpha (the
+    scatter's marker alpha) to 1 on occupied pixels. Returns (rgba image,
+    extent).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    segments = np.asarray(segments)
+    extent = [x.min(), x.max(), y.min(), y.max()]
+
+    counts = np.stack([
+        np.histogram2d(
+            y[segments == seg], x[segments == seg],
+            bins=[height, width], range=[extent[2:], extent[:2]],
+        )[0]
+        for seg in colors
+    ])
+    if spread:
+        counts = _spread(counts, spread)
+    total = counts.sum(axis=0)
+
+    rgba = np.asarray(list(colors.values()))[counts.argmax(axis=0)]
+    density = np.log1p(total) / np.log1p(total.max())
+    rgba[..., 3] = np.where(total > 0, min_alpha + (1 - min_alpha) * density, 0.0)
+    return rgba, extent
+
+
 def plot_recency_frequency_scatter(df: pd.DataFrame, cluster_col: str):
     """Recency vs Frequency scatter colored by segment."""
     fig, ax = plt.subplots(figsize=(6, 4))
-    scatter = ax.scatter(
-        df["Recency"],
-        df["Frequency"],
-        c=df[cluster_col],
-        alpha=0.5,
-    )
+
+    if len(df) > SCATTER_RASTER_THRESHOLD:
+        segments = np.sort(df[cluster_col].unique())
+        norm = plt.Normalize(segments.min(), segments.max())
+        colors = {seg: plt.get_cmap()(norm(seg)) for seg in segments}
+
+        # one grid cell per output pixel of the axes at the saved dpi
+        bbox = ax.get_window_extent()
+        scale = SAVEFIG_KWARGS["dpi"] / fig.dpi
+        img, extent = rasterize_by_segment(
+            df["Recency"], df["Frequency"], df[cluster_col], colors,
+            width=int(bbox.width * scale), height=int(bbox.height * scale),
+        )
+        ax.imshow(
+            img, extent=extent, origin="lower", aspect="auto", interpolation="nearest"
+        )
+
+        handles = [Line2D([], [], marker="o", linestyle="", color=c) for c in colors.values()]
+        labels = [str(seg) for seg in segments]
+    else:
+        scatter = ax.scatter(
+            df["Recency"],
+            df["Frequency"],
+            c=df[cluster_col],
+            alpha=0.5,
+        )
+        # Simple legend: unique segments
+        handles, labels = scatter.legend_elements()
+
     ax.set_title(f"Recency vs Frequency by Segment ({cluster_col})")
     ax.set_xlabel("Recency (days)")
     ax.set_ylabel("Frequency (# orders)")
     ax.grid(True, alpha=0.3)
 
-    # Simple legend: unique segments
-    handles, labels = scatter.legend_elements()
     ax.legend(handles, labels, title="Segment", loc="best")
 
     plt.tight_layout()
     out_path = FIG_DIR / "recency_frequency_scatter.png"
-    plt.savefig(out_path, dpi=150, bbox_inches="tight")
+    fig.savefig(out_path, **SAVEFIG_KWARGS)
     plt.close(fig)
     print(f"Saved {out_path}")
 
@@ -139,7 +218,7 @@ def plot_revenue_by_country(df: pd.DataFrame, top_n: int = 10):
         return
 
     country_rev = (
-        df.groupby("PrimaryCountry")["Monetary"]
+        df.groupby("PrimaryCountry", sort=False)["Monetary"]
         .sum()
         .rename("Revenue")
         .reset_index()
@@ -158,7 +237,7 @@ def plot_revenue_by_country(df: pd.DataFrame, top_n: int = 10):
 
     plt.tight_layout()
     out_path = FIG_DIR / "revenue_by_country.png"
-    plt.savefig(out_path, dpi=150, bbox_inches="tight")
+    fig.savefig(out_path, **SAVEFIG_KWARGS)
     plt.close(fig)
     print(f"Saved {out_path}")
 
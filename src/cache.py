@@ -0,0 +1,14 @@
+# src/cache.py
+
+import hashlib
+from pathlib import Path
+
+CACHE_DIR = Path("data/cache")
+
+
+def source_version(path: str | Path) -> str:
+    """
+    Short hash of a source file, used as part of a cache key so that
+    editing the module that produced a cached result invalidates it.
+    """
+    return hashlib.blake2b(Path(path).read_bytes(), digest_size=4).hexdigest()
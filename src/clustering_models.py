@@ -1,51 +1,141 @@
 # src/clustering_models.py
 
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
 from typing import Iterable
 
 import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans, AgglomerativeClustering
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans, MiniBatchKMeans, AgglomerativeClustering
 from sklearn.mixture import GaussianMixture
-from sklearn.metrics import silhouette_score
-from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import pairwise_distances_argmin, silhouette_score
 
+from src.cache import CACHE_DIR, source_version
 
-def scale_features(df: pd.DataFrame, cols: list[str]):
+
+@dataclass
+class FeatureScaler:
+    """Per-column mean/std from scale_features (StandardScaler equivalent)."""
+
+    mean: np.ndarray
+    std: np.ndarray
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        return (np.asarray(X, dtype=np.float64) - self.mean) / self.std
+
+
+def scale_features(X: np.ndarray):
     """
-    Standardize selected numeric features.
+    Standardize the columns of a feature matrix.
+
+    Scales in place when X is already a contiguous float64 array, otherwise
+    works on a float64 copy. Stays in float64 on purpose: Ward's top-level
+    merge is a near-tie on this data and float32 rounding re-segments
+    hundreds of customers. Constant columns get std 1 (as StandardScaler
+    does).
     """
-    scaler = StandardScaler()
-    X = scaler.fit_transform(df[cols])
-    return X, scaler
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    mean = X.mean(axis=0)
+    std = X.std(axis=0)
+    std[std == 0] = 1.0
+    X -= mean
+    X /= std
+    return X, FeatureScaler(mean=mean, std=std)
+
+
+# above this many rows the k sweep switches to MiniBatchKMeans and a
+# sampled silhouette; below it, the scores come from the same full KMeans
+# that fit_kmeans uses
+LARGE_N = 20_000
+
+
+def _fit_one_k(X: np.ndarray, k: int) -> dict:
+    if X.shape[0] > LARGE_N:
+        model = MiniBatchKMeans(n_clusters=k, random_state=42, batch_size=4096, n_init=3)
+        sample_size = 10_000
+    else:
+        model = KMeans(n_clusters=k, random_state=42)
+        sample_size = None
+    labels = model.fit_predict(X)
+    sil = silhouette_score(X, labels, sample_size=sample_size, random_state=42)
+    return {"k": k, "silhouette": sil, "inertia": model.inertia_}
 
 
 def evaluate_kmeans(X: np.ndarray, k_list: Iterable[int] = range(2, 9)) -> pd.DataFrame:
     """
     Evaluate KMeans for different k using silhouette and inertia.
+
+    Each k is fitted in its own worker. Above LARGE_N rows the fits use
+    MiniBatchKMeans and silhouette is computed on a 10k-row sample (the
+    full score is O(N^2)); smaller inputs get full KMeans and exact scores.
     """
-    results = []
-    for k in k_list:
-        model = KMeans(n_clusters=k, random_state=42)
-        labels = model.fit_predict(X)
-        sil = silhouette_score(X, labels)
-        inertia = model.inertia_
-        results.append({"k": k, "silhouette": sil, "inertia": inertia})
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    results = Parallel(n_jobs=-1)(delayed(_fit_one_k)(X, k) for k in k_list)
     return pd.DataFrame(results)
 
 
+def evaluate_kmeans_cached(
+    X: np.ndarray,
+    k_list: Iterable[int] = range(2, 9),
+    cache_dir: Path = CACHE_DIR,
+) -> pd.DataFrame:
+    """
+    evaluate_kmeans, cached on disk.
+
+    The k sweep is the slowest clustering step and is deterministic, so
+    its table is stored under cache_dir keyed by a hash of the scaled
+    matrix, the k values and this module's source.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    k_list = list(k_list)
+
+    digest = hashlib.blake2b(X.tobytes(), digest_size=16)
+    digest.update(repr((X.shape, k_list)).encode())
+    key = f"kmeans_eval_{digest.hexdigest()}_{source_version(__file__)}"
+    eval_path = Path(cache_dir) / f"{key}.parquet"
+
+    if eval_path.exists():
+        return pd.read_parquet(eval_path)
+
+    eval_df = evaluate_kmeans(X, k_list)
+    eval_path.parent.mkdir(parents=True, exist_ok=True)
+    eval_df.to_parquet(eval_path)
+    return eval_df
+
+
 def fit_kmeans(X: np.ndarray, k: int = 4) -> KMeans:
     model = KMeans(n_clusters=k, random_state=42)
     model.fit(X)
     return model
 
 
-def fit_hierarchical(X: np.ndarray, k: int = 4):
+def fit_hierarchical(X: np.ndarray, k: int = 4, sample_size: int = 5000):
+    """
+    Agglomerative clustering is O(N^2) in memory and worse in time, so
+    above sample_size rows it is fitted on a random sample and every other
+    row is assigned to the nearest sample-cluster centroid.
+    """
     model = AgglomerativeClustering(n_clusters=k)
-    labels = model.fit_predict(X)
+    if X.shape[0] <= sample_size:
+        labels = model.fit_predict(X)
+        return model, labels
+
+    idx = np.random.default_rng(42).choice(X.shape[0], size=sample_size, replace=False)
+    X_sample = X[idx]
+    sample_labels = model.fit_predict(X_sample)
+
+    centroids = np.stack([X_sample[sample_labels == c].mean(axis=0) for c in range(k)])
+    labels = pairwise_distances_argmin(X, centroids)
+    labels[idx] = sample_labels
     return model, labels
 
 
 def fit_gmm(X: np.ndarray, k: int = 4):
+    # the CatShare_* columns sum to 1, so the covariance is singular up to
+    # reg_covar; that regularisation is too small to survive float32 Cholesky
+    X = np.asarray(X, dtype=np.float64)
     model = GaussianMixture(n_components=k, random_state=42)
     labels = model.fit_predict(X)
     return model, labels
@@ -1,22 +1,52 @@
 # src/clv.py
 
+import hashlib
+import json
+from pathlib import Path
+
 import pandas as pd
-from lifetimes.utils import summary_data_from_transaction_data
 from lifetimes import BetaGeoFitter, GammaGammaFitter
 
+from src.cache import CACHE_DIR, source_version
+
 
 def prepare_summary(df: pd.DataFrame) -> pd.DataFrame:
     """
     Prepare lifetimes summary.
     df must have: CustomerID, InvoiceDate, TotalPrice
+
+    Same output as lifetimes' summary_data_from_transaction_data at daily
+    frequency, computed with groupby aggregations: purchases on the same day
+    count as one period, frequency/recency/T are in days, and
+    monetary_value is the mean spend of the repeat (non-first) days.
     """
-    summary = summary_data_from_transaction_data(
-        df,
-        customer_id_col="CustomerID",
-        datetime_col="InvoiceDate",
-        monetary_value_col="TotalPrice",
-        observation_period_end=df["InvoiceDate"].max()
+    obs_end = df["InvoiceDate"].max().floor("D")
+
+    # one row per customer x day, sorted by customer then day
+    daily = (
+        df.groupby(["CustomerID", df["InvoiceDate"].dt.floor("D")])["TotalPrice"]
+        .sum()
+        .reset_index()
     )
+
+    g = daily.groupby("CustomerID", sort=False)["InvoiceDate"]
+    first = g.min()
+    summary = pd.DataFrame(
+        {
+            "frequency": g.size() - 1,
+            "recency": (g.max() - first).dt.days,
+            "T": (obs_end - first).dt.days,
+        }
+    )
+
+    # sorted by day, so a customer's first occurrence is their first purchase
+    repeat = daily[daily["CustomerID"].duplicated()]
+    summary["monetary_value"] = (
+        repeat.groupby("CustomerID", sort=False)["TotalPrice"].mean()
+        .reindex(summary.index, fill_value=0)
+    )
+
+    summary = summary.astype(float)
     summary = summary[summary["monetary_value"] > 0]
     return summary
 
@@ -41,18 +71,70 @@ def estimate_clv(summary: pd.DataFrame, bgf, ggf, months: int = 6) -> pd.DataFra
     summary = summary.copy()
     t = months * 30  # days
 
+    # lifetimes evaluates these formulas with numpy ufuncs; hand it plain
+    # contiguous float64 arrays so no pandas alignment runs per operation
+    frequency = summary["frequency"].to_numpy(dtype="float64")
+    recency = summary["recency"].to_numpy(dtype="float64")
+    T = summary["T"].to_numpy(dtype="float64")
+    monetary_value = summary["monetary_value"].to_numpy(dtype="float64")
+
     summary["PredPurchases"] = bgf.conditional_expected_number_of_purchases_up_to_time(
         t,
-        summary["frequency"],
-        summary["recency"],
-        summary["T"]
+        frequency,
+        recency,
+        T
     )
 
     summary["ExpAvgValue"] = ggf.conditional_expected_average_profit(
-        summary["frequency"],
-        summary["monetary_value"]
+        frequency,
+        monetary_value
     )
 
     summary[f"CLV_{months}m"] = summary["PredPurchases"] * summary["ExpAvgValue"]
 
     return summary
+
+
+def transactions_fingerprint(df: pd.DataFrame) -> str:
+    """
+    Content hash of the CLV inputs (CustomerID, InvoiceDate, TotalPrice).
+    """
+    hashed = pd.util.hash_pandas_object(
+        df[["CustomerID", "InvoiceDate", "TotalPrice"]], index=False
+    )
+    return hashlib.blake2b(hashed.to_numpy().tobytes(), digest_size=16).hexdigest()
+
+
+def estimate_clv_cached(
+    df: pd.DataFrame, months: int = 6, cache_dir: Path = CACHE_DIR
+) -> pd.DataFrame:
+    """
+    prepare_summary + fit_clv_models + estimate_clv, cached on disk.
+
+    The BG/NBD and Gamma-Gamma fits are the slowest part of the CLV step
+    and give identical results for identical transactions, so the output
+    is stored under cache_dir keyed by a fingerprint of the inputs and of
+    this module's source. Fitted parameters are written alongside as JSON
+    for reference.
+    """
+    key = f"clv_{transactions_fingerprint(df)}_{source_version(__file__)}_{months}m"
+    clv_path = Path(cache_dir) / f"{key}.parquet"
+    params_path = Path(cache_dir) / f"{key}.json"
+
+    if clv_path.exists():
+        return pd.read_parquet(clv_path)
+
+    summary = prepare_summary(df)
+    bgf, ggf = fit_clv_models(summary)
+    clv = estimate_clv(summary, bgf, ggf, months=months)
+
+    clv_path.parent.mkdir(parents=True, exist_ok=True)
+    clv.to_parquet(clv_path)
+    params_path.write_text(
+        json.dumps(
+            {"bgf": bgf.params_.to_dict(), "ggf": ggf.params_.to_dict()},
+            indent=2,
+        )
+    )
+
+    return clv
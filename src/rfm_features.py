@@ -1,88 +1,172 @@
 # src/rfm_features.py
 
 from datetime import datetime
+import numpy as np
 import pandas as pd
 
 
-def compute_rfm(df: pd.DataFrame, reference_date: datetime | None = None) -> pd.DataFrame:
+def factorize_customers(df: pd.DataFrame) -> tuple[np.ndarray, pd.Index]:
+    """
+    Map every row to an integer customer code (position in the sorted
+    unique CustomerIDs). Returns (codes, customers), where customers is
+    the CustomerID index shared by all feature tables.
+    """
+    codes, customers = pd.factorize(df["CustomerID"], sort=True)
+    return codes, pd.Index(customers, name="CustomerID")
+
+
+def compute_rfm(
+    df: pd.DataFrame,
+    reference_date: datetime | None = None,
+    customer_codes: tuple[np.ndarray, pd.Index] | None = None,
+) -> pd.DataFrame:
     """
     Compute RFM per customer:
     - Recency: days since last purchase
     - Frequency: number of unique invoices
     - Monetary: total spend
-    """
-    df = df.copy()
+    Returns one row per customer, indexed by CustomerID.
 
+    customer_codes: optional output of factorize_customers(df), to reuse
+    one factorization across the feature functions.
+    """
     if reference_date is None:
         reference_date = df["InvoiceDate"].max() + pd.Timedelta(days=1)
 
-    rfm = df.groupby("CustomerID").agg(
-        Recency=("InvoiceDate", lambda x: (reference_date - x.max()).days),
-        Frequency=("InvoiceNo", "nunique"),
-        Monetary=("TotalPrice", "sum")
-    ).reset_index()
+    codes, customers = customer_codes if customer_codes is not None else factorize_customers(df)
+    n_customers = len(customers)
 
-    return rfm
+    # per-customer reductions scattered straight into arrays indexed by code
+    dates = df["InvoiceDate"].to_numpy()
+    last_purchase = np.full(n_customers, np.iinfo(np.int64).min)
+    np.maximum.at(last_purchase, codes, dates.view(np.int64))
+    recency = (reference_date - pd.DatetimeIndex(last_purchase.view(dates.dtype))).days
+
+    # unique invoices per customer: one global dedup of (customer, invoice)
+    # pairs packed into an int64 key, instead of nunique's per-group hash sets
+    invoice_codes, invoices = pd.factorize(df["InvoiceNo"])
+    pairs = pd.unique(codes.astype(np.int64) * len(invoices) + invoice_codes)
+    frequency = np.bincount(pairs // len(invoices), minlength=n_customers)
+
+    monetary = np.bincount(
+        codes, weights=df["TotalPrice"].to_numpy(dtype=np.float64), minlength=n_customers
+    )
 
+    rfm = pd.DataFrame(
+        {
+            "Recency": recency.astype("int32"),
+            "Frequency": frequency,
+            "Monetary": monetary,
+        },
+        index=customers,
+    )
 
-def _map_category(desc: str) -> str:
-    """Simple keyword-based categories from Description."""
-    desc = str(desc).lower()
-    if any(k in desc for k in ["bag", "wallet", "purse"]):
-        return "Bags"
-    if any(k in desc for k in ["mug", "cup", "plate", "bowl"]):
-        return "Kitchen"
-    if any(k in desc for k in ["lamp", "candle", "lantern", "light"]):
-        return "HomeDecor"
-    if any(k in desc for k in ["toy", "party", "game"]):
-        return "Toys"
-    return "Other"
+    return rfm
 
 
-def add_category_features(df: pd.DataFrame) -> pd.DataFrame:
+CATEGORIES = ["Bags", "HomeDecor", "Kitchen", "Other", "Toys"]  # CatShare_* column order
+
+# keyword -> category, matched as lowercase substrings of Description
+_KEYWORD_TO_CAT = {
+    "bag": "Bags", "wallet": "Bags", "purse": "Bags",
+    "mug": "Kitchen", "cup": "Kitchen", "plate": "Kitchen", "bowl": "Kitchen",
+    "lamp": "HomeDecor", "candle": "HomeDecor", "lantern": "HomeDecor", "light": "HomeDecor",
+    "toy": "Toys", "party": "Toys", "game": "Toys",
+}
+
+# one alternation per category, checked in order; the first matching
+# category wins, else "Other"
+_CATEGORY_PATTERNS = [
+    (cat, "|".join(kw for kw, c in _KEYWORD_TO_CAT.items() if c == cat))
+    for cat in dict.fromkeys(_KEYWORD_TO_CAT.values())
+]
+
+
+def _map_categories(desc: pd.Series) -> pd.Categorical:
+    """Simple keyword-based categories from Description (vectorized)."""
+    # the same product text repeats across invoice lines: classify each
+    # distinct description once and gather back through the codes
+    codes, uniques = pd.factorize(desc.astype("string[pyarrow]"))
+    uniques = pd.Series(uniques)
+
+    # lowercase once, then case-sensitive matching: Arrow's RE2 compiles each
+    # keyword alternation into a DFA, so every pattern is one linear scan
+    uniques = uniques.str.lower()
+    masks = [
+        uniques.str.contains(pattern, regex=True, na=False).to_numpy(dtype=bool)
+        for _, pattern in _CATEGORY_PATTERNS
+    ]
+    labels = np.select(masks, [cat for cat, _ in _CATEGORY_PATTERNS], default="Other")
+
+    # missing descriptions have code -1, which picks the trailing "Other"
+    category_codes = pd.Categorical(labels, categories=CATEGORIES).codes
+    category_codes = np.append(category_codes, CATEGORIES.index("Other"))
+    return pd.Categorical.from_codes(category_codes[codes], categories=CATEGORIES)
+
+
+def add_category_features(
+    df: pd.DataFrame,
+    customer_codes: tuple[np.ndarray, pd.Index] | None = None,
+) -> pd.DataFrame:
     """
     For each customer, compute share of revenue in each product category.
-    Returns a wide table with columns CatShare_* and one row per CustomerID.
+    Returns a wide table with columns CatShare_*, indexed by CustomerID.
     """
-    df = df.copy()
-    df["Category"] = df["Description"].apply(_map_category)
-
-    # total revenue per CustomerID x Category
-    cat = df.groupby(["CustomerID", "Category"])["TotalPrice"].sum()
-
-    # make columns for categories (one row per CustomerID)
-    cat = cat.unstack(fill_value=0)  # index: CustomerID, columns: Category
-
-    # convert absolute revenue to share per customer
-    row_sums = cat.sum(axis=1)
-    cat = cat.div(row_sums, axis=0).fillna(0)
-
-    # rename columns
-    cat.columns = [f"CatShare_{c}" for c in cat.columns]
-
-    # bring CustomerID back as a column
-    cat = cat.reset_index()  # index -> column "CustomerID"
+    codes, customers = customer_codes if customer_codes is not None else factorize_customers(df)
+    category_codes = _map_categories(df["Description"]).codes
+
+    # dense (customer x category) revenue matrix from one bincount over the
+    # flattened cell index, instead of a MultiIndex groupby + unstack
+    n_customers, n_categories = len(customers), len(CATEGORIES)
+    revenue = np.bincount(
+        codes.astype(np.int64) * n_categories + category_codes,
+        weights=df["TotalPrice"].to_numpy(dtype=np.float64),
+        minlength=n_customers * n_categories,
+    ).reshape(n_customers, n_categories)
+
+    # convert absolute revenue to share per customer, in place
+    row_sums = revenue.sum(axis=1, keepdims=True)
+    np.divide(revenue, row_sums, out=revenue, where=row_sums > 0)
+
+    cat = pd.DataFrame(
+        revenue, index=customers, columns=[f"CatShare_{c}" for c in CATEGORIES]
+    )
 
     return cat
 
 
-def add_demographics(df: pd.DataFrame) -> pd.DataFrame:
+def add_demographics(
+    df: pd.DataFrame,
+    customer_codes: tuple[np.ndarray, pd.Index] | None = None,
+) -> pd.DataFrame:
     """
     For each customer:
     - PrimaryCountry: where they spend the most
     - IsUK: 1 if primary country is United Kingdom
+    Indexed by CustomerID; customers with no known country are left out.
     """
-    df = df.copy()
-
-    cc = (
-        df.groupby(["CustomerID", "Country"])["TotalPrice"]
-        .sum()
-        .reset_index()
+    codes, customers = customer_codes if customer_codes is not None else factorize_customers(df)
+
+    # sorted country codes, so argmax breaks ties alphabetically like idxmax did;
+    # rows without a country get code -1 and are left out
+    country_codes, countries = pd.factorize(df["Country"], sort=True)
+    has_country = country_codes >= 0
+
+    # dense (customer x country) spend matrix in one scatter-add, then one
+    # argmax per row instead of groupby + idxmax + .loc gather
+    spend = np.zeros((len(customers), len(countries)))
+    np.add.at(
+        spend,
+        (codes[has_country], country_codes[has_country]),
+        df["TotalPrice"].to_numpy(dtype=np.float64)[has_country],
     )
 
-    idx = cc.groupby("CustomerID")["TotalPrice"].idxmax()
-    primary = cc.loc[idx, ["CustomerID", "Country"]]
-    primary.rename(columns={"Country": "PrimaryCountry"}, inplace=True)
+    # customers who only have unknown countries get no row (NaN after join)
+    known = spend.max(axis=1) > 0
+    primary = pd.DataFrame(
+        {"PrimaryCountry": countries.take(spend[known].argmax(axis=1))},
+        index=customers[known],
+    )
 
     primary["IsUK"] = (primary["PrimaryCountry"] == "United Kingdom").astype(int)
 
@@ -94,14 +178,19 @@ def build_feature_matrix(df: pd.DataFrame) -> pd.DataFrame:
     Combine RFM + category shares + demographics into
     one customer-level feature table.
     """
-    rfm = compute_rfm(df)
-    cat = add_category_features(df)
-    demo = add_demographics(df)
+    # hash CustomerID once and share the codes across all three blocks
+    customer_codes = factorize_customers(df)
 
+    rfm = compute_rfm(df, customer_codes=customer_codes)
+    cat = add_category_features(df, customer_codes=customer_codes)
+    demo = add_demographics(df, customer_codes=customer_codes)
+
+    # all three are indexed by CustomerID: align on the index, no hash join
     features = (
         rfm
-        .merge(cat, on="CustomerID", how="left")
-        .merge(demo, on="CustomerID", how="left")
+        .join(cat, how="left")
+        .join(demo, how="left")
+        .reset_index()
     )
 
     return features